@@ -16,6 +16,14 @@ if [ "$EUID" -eq 0 ]; then
    exit 1
 fi
 
+# Config loading is much faster with PyYAML's libyaml (C) loader
+if ! python3 -c "import yaml; yaml.CSafeLoader" 2>/dev/null; then
+   echo "WARNING: PyYAML is missing or was built without libyaml"
+   echo "  Install it with:  sudo apt install python3-yaml"
+   echo "  or (virtualenv):  sudo apt install libyaml-dev && pip install --force-reinstall --no-binary pyyaml pyyaml"
+   echo ""
+fi
+
 # Copy service files
 echo "Copying service files to /etc/systemd/system/..."
 sudo cp systemd/*.service /etc/systemd/system/
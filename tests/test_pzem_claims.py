@@ -0,0 +1,116 @@
+"""
+Tests for the PZEM upload claim protocol (stale claim recovery)
+
+Run from the repository root:
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+try:
+    from weatherstation.database.db_manager import DatabaseManager, UPLOAD_IN_FLIGHT
+except ImportError as e:  # e.g. weatherstation.utils.logger not available
+    DatabaseManager = None
+    IMPORT_ERROR = e
+
+SCHEMA_FILE = (
+    Path(__file__).resolve().parent.parent
+    / 'weatherstation' / 'database' / 'database_schema_v2.sql'
+)
+
+
+class PzemClaimTest(unittest.TestCase):
+    """release_pzem_claims() recovering claims left by a dead uploader"""
+
+    def setUp(self):
+        if DatabaseManager is None:
+            self.skipTest(f"db_manager not importable: {IMPORT_ERROR}")
+        if not SCHEMA_FILE.exists():
+            self.skipTest(f"Schema file not found: {SCHEMA_FILE}")
+
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self._tmpdir.name, 'test.db')
+        self.db = DatabaseManager(self.db_path)
+        self.db.insert_pzem_data_many([
+            ('pzem_1', {'voltage': 230.0, 'current': 1.0}),
+            ('pzem_1', {'voltage': 231.0, 'current': 1.5}),
+            ('pzem_2', {'voltage': 229.5, 'current': 0.5}),
+        ])
+
+    def tearDown(self):
+        self.db.close()
+        self._tmpdir.cleanup()
+
+    def _shift_claims(self, seconds: float):
+        """Move every recorded claim time by seconds"""
+        with self.db.get_connection() as conn:
+            conn.execute(
+                "UPDATE pzem_upload_claims SET claimed_at = claimed_at + ?",
+                (seconds,)
+            )
+
+    def _in_flight_count(self) -> int:
+        with self.db.get_connection() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM pzem_data WHERE uploaded = ?",
+                (UPLOAD_IN_FLIGHT,)
+            ).fetchone()[0]
+
+    def _upload_cycle_claim(self, db: DatabaseManager):
+        """Release stale claims then claim, as UploadService does each cycle"""
+        db.release_pzem_claims(max_age=60)
+        return db.claim_pending_pzem_data(limit=10)
+
+    def test_claim_marks_rows_in_flight(self):
+        claimed = self.db.claim_pending_pzem_data(limit=10)
+
+        self.assertEqual(len(claimed), 3)
+        self.assertTrue(all(record['uploaded'] == 0 for record in claimed))
+        self.assertEqual(self._in_flight_count(), 3)
+        self.assertEqual(self.db.get_pending_counts()['pzem'], 0)
+
+    def test_fresh_claim_is_kept(self):
+        self.db.claim_pending_pzem_data(limit=10)
+
+        # Another uploader (new process, same database) must not take them
+        other = DatabaseManager(self.db_path)
+        self.assertEqual(self._upload_cycle_claim(other), [])
+        self.assertEqual(self._in_flight_count(), 3)
+
+    def test_restart_after_crash_recovers_claims_on_later_cycle(self):
+        # Uploader claims, then dies before confirming or unclaiming
+        self.db.claim_pending_pzem_data(limit=10)
+
+        # Restarted well within max_age: first cycle leaves them alone
+        restarted = DatabaseManager(self.db_path)
+        self.assertEqual(self._upload_cycle_claim(restarted), [])
+
+        # A later cycle, once the claims have aged past max_age
+        self._shift_claims(-61)
+        self.assertEqual(len(self._upload_cycle_claim(restarted)), 3)
+
+    def test_claim_from_the_future_is_stale(self):
+        # Clock moved back after the claim (e.g. fake-hwclock after power loss)
+        self.db.claim_pending_pzem_data(limit=10)
+        self._shift_claims(3600)
+
+        self.assertEqual(self.db.release_pzem_claims(max_age=60), 3)
+        self.assertEqual(self._in_flight_count(), 0)
+        self.assertEqual(self.db.get_pending_counts()['pzem'], 3)
+
+    def test_in_flight_row_without_claim_entry_is_stale(self):
+        self.db.claim_pending_pzem_data(limit=10)
+        with self.db.get_connection() as conn:
+            conn.execute("DELETE FROM pzem_upload_claims")
+
+        self.assertEqual(len(self._upload_cycle_claim(self.db)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
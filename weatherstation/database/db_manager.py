@@ -5,16 +5,135 @@ Handles all database operations for devices, data storage, and uploads
 
 import sqlite3
 import json
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+import threading
+import copy
+import time
+from typing import List, Dict, Any, Optional, Iterator, Tuple
 from pathlib import Path
 from contextlib import contextmanager
 
 from weatherstation.utils.logger import get_logger
 
+try:
+    import orjson
+except ImportError:  # optional, falls back to the stdlib encoder
+    orjson = None
+
 logger = get_logger(__name__)
 
 
+def _json_dumps(obj) -> str:
+    """Encode a value bound as a JSON column or json_each() parameter"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass  # e.g. ints too large for orjson; let json decide
+    return json.dumps(obj)
+
+# Update in place on re-registration (keeps the row id and status columns,
+# unlike INSERT OR REPLACE which deletes and re-inserts the row)
+UPSERT_DEVICE_SQL = """
+    INSERT INTO devices (
+        device_id, device_type, device_name, device_model,
+        modbus_address, location, description, metadata, enabled
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(device_id) DO UPDATE SET
+        device_type = excluded.device_type,
+        device_name = excluded.device_name,
+        device_model = excluded.device_model,
+        modbus_address = excluded.modbus_address,
+        location = excluded.location,
+        description = excluded.description,
+        metadata = excluded.metadata,
+        enabled = excluded.enabled
+"""
+
+INSERT_PZEM_SQL = """
+    INSERT INTO pzem_data (
+        device_id, modbus_address, voltage, current, power,
+        energy, frequency, power_factor, read_quality,
+        error_code, timestamp
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, strftime('%Y-%m-%dT%H:%M:%fZ', 'now')))
+"""
+
+# DELETE ... RETURNING needs SQLite 3.35+
+SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Batches larger than this are loaded with indexes dropped and rebuilt afterwards
+BULK_LOAD_THRESHOLD = 10_000
+
+# Cleanup deletes at most this many rows per transaction so the write lock
+# is released between batches
+CLEANUP_BATCH_SIZE = 10_000
+
+# Default pause between cleanup batches (seconds), giving other writers a
+# chance at the lock
+CLEANUP_BATCH_PAUSE = 0.01
+
+# `uploaded` value for rows claimed by an upload that hasn't been confirmed
+# yet (0 = pending, 1 = uploaded). Left-over claims from a crashed uploader
+# are returned to pending by release_pzem_claims().
+UPLOAD_IN_FLIGHT = 2
+
+# Claims older than this (seconds) are assumed abandoned by a dead uploader
+STALE_CLAIM_AGE = 60
+
+# When each in-flight PZEM row was claimed, so only stale claims are released
+CLAIMS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS pzem_upload_claims (
+        id INTEGER PRIMARY KEY,
+        claimed_at REAL NOT NULL
+    )
+"""
+
+# Uploadable data types and their tables
+DATA_TABLES = {
+    'pzem': 'pzem_data',
+    'weather': 'weather_data',
+    'mqtt': 'mqtt_data',
+    'battery': 'battery_data'
+}
+
+# Applied to every new connection (journal_mode=WAL is persistent and set once)
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -20000",
+    "PRAGMA busy_timeout = 5000",
+    # Truncate the -wal file back to 64 MB after checkpoints
+    "PRAGMA journal_size_limit = 67108864",
+)
+
+# Indexes maintained alongside the schema file: (table, index name, CREATE INDEX statement)
+INDEXES = [
+    ('devices', 'idx_devices_type_modbus', """
+        CREATE INDEX IF NOT EXISTS idx_devices_type_modbus
+        ON devices(device_type, modbus_address)
+        WHERE enabled = 1 AND modbus_address IS NOT NULL
+    """),
+    # Pending-upload scans (uploaded = 0 ORDER BY timestamp) and cleanup
+    # (uploaded = 1 AND timestamp < cutoff)
+    ('pzem_data', 'idx_pzem_data_uploaded_ts', """
+        CREATE INDEX IF NOT EXISTS idx_pzem_data_uploaded_ts
+        ON pzem_data(uploaded, timestamp)
+    """),
+    ('weather_data', 'idx_weather_data_uploaded_ts', """
+        CREATE INDEX IF NOT EXISTS idx_weather_data_uploaded_ts
+        ON weather_data(uploaded, timestamp)
+    """),
+    ('mqtt_data', 'idx_mqtt_data_uploaded_ts', """
+        CREATE INDEX IF NOT EXISTS idx_mqtt_data_uploaded_ts
+        ON mqtt_data(uploaded, timestamp)
+    """),
+    ('battery_data', 'idx_battery_data_uploaded_ts', """
+        CREATE INDEX IF NOT EXISTS idx_battery_data_uploaded_ts
+        ON battery_data(uploaded, timestamp)
+    """),
+]
+
+
 class DatabaseManager:
     """
     Manages all database operations for the weather station system
@@ -28,41 +147,100 @@ class DatabaseManager:
             db_path: Path to SQLite database file
         """
         self.db_path = db_path
+        self._local = threading.local()  # One open connection per thread
+        self._stats_cache = None  # (monotonic time, stats) from get_cleanup_stats
+        self._devices_cache = {}  # (device_type, columns) -> (monotonic time, devices)
 
         # Create database directory if not exists
         Path(db_path).parent.mkdir(parents=True, exist_ok=True)
 
+        # Switch to write-ahead logging (stored in the database file)
+        with self.get_connection() as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+
         # Initialize database (create tables if not exist)
         self._initialize_database()
 
+    def _create_connection(self) -> sqlite3.Connection:
+        """Open a new database connection"""
+        # Room for every distinct statement in this module in the per-connection
+        # statement cache; no column type converters are registered
+        conn = sqlite3.connect(self.db_path, cached_statements=256, detect_types=0)
+        conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+        self._configure_connection(conn)
+        return conn
+
+    def _configure_connection(self, conn: sqlite3.Connection):
+        """Apply per-connection PRAGMAs"""
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+
     @contextmanager
     def get_connection(self):
-        """Get database connection context manager"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+        """Get database connection context manager (connection is kept open per thread)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._create_connection()
+            self._local.conn = conn
+
         try:
             yield conn
             conn.commit()
         except Exception as e:
             conn.rollback()
-            logger.error(f"Database error: {e}")
+            logger.error("Database error: %s", e)
             raise
-        finally:
+
+    def close(self):
+        """Close the calling thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
             conn.close()
 
+    @staticmethod
+    def _iter_dicts(conn: sqlite3.Connection, query: str, params=()) -> Iterator[Dict[str, Any]]:
+        """
+        Run a query and yield each row as a dict
+
+        Rows are fetched as plain tuples and zipped with column names read
+        once from the cursor, skipping the per-row sqlite3.Row object that
+        dict(row) would otherwise copy from.
+        """
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(query, params)
+        names = tuple(column[0] for column in cursor.description)
+        for row in cursor:
+            yield dict(zip(names, row))
+
     def _initialize_database(self):
         """Initialize database schema if not exists"""
         schema_file = Path(__file__).parent / 'database_schema_v2.sql'
 
         if not schema_file.exists():
-            logger.warning(f"Schema file not found: {schema_file}")
+            logger.warning("Schema file not found: %s", schema_file)
             return
 
         with self.get_connection() as conn:
             with open(schema_file, 'r') as f:
                 conn.executescript(f.read())
+            conn.execute(CLAIMS_TABLE_SQL)
+            self._create_indexes(conn)
         logger.info("Database initialized successfully")
 
+    def _create_indexes(self, conn: sqlite3.Connection):
+        """Create indexes for the tables that exist in this database"""
+        existing_tables = {
+            row['name'] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table'"
+            )
+        }
+
+        for table_name, _, index_sql in INDEXES:
+            if table_name in existing_tables:
+                conn.execute(index_sql)
+
     # ============================================================================
     # DEVICE MANAGEMENT
     # ============================================================================
@@ -97,27 +275,69 @@ class DatabaseManager:
             True if successful
         """
         try:
-            metadata = json.dumps(kwargs) if kwargs else None
+            metadata = _json_dumps(kwargs) if kwargs else None
 
             with self.get_connection() as conn:
-                conn.execute("""
-                    INSERT OR REPLACE INTO devices (
-                        device_id, device_type, device_name, device_model,
-                        modbus_address, location, description, metadata, enabled
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
+                conn.execute(UPSERT_DEVICE_SQL, (
                     device_id, device_type, device_name, device_model,
                     modbus_address, location, description, metadata,
                     1 if enabled else 0
                 ))
+            self._devices_cache = {}
 
-            logger.info(f"Registered device: {device_id} ({device_type})")
+            logger.debug("Registered device: %s (%s)", device_id, device_type)
             return True
 
         except Exception as e:
-            logger.error(f"Failed to register device {device_id}: {e}")
+            logger.error("Failed to register device %s: %s", device_id, e)
             return False
 
+    def register_devices(self, devices: List[Dict[str, Any]]) -> int:
+        """
+        Register or update many devices in a single transaction
+
+        Args:
+            devices: List of dicts with the same keys as register_device()
+                     arguments; unknown keys are stored as metadata
+
+        Returns:
+            Number of devices written (0 on failure)
+        """
+        known = {
+            'device_id', 'device_type', 'device_name', 'device_model',
+            'modbus_address', 'location', 'description', 'enabled'
+        }
+
+        try:
+            rows = []
+            for device in devices:
+                extra = {k: v for k, v in device.items() if k not in known}
+                rows.append((
+                    device['device_id'],
+                    device['device_type'],
+                    device.get('device_name'),
+                    device.get('device_model'),
+                    device.get('modbus_address'),
+                    device.get('location'),
+                    device.get('description'),
+                    _json_dumps(extra) if extra else None,
+                    1 if device.get('enabled', True) else 0
+                ))
+
+            if not rows:
+                return 0
+
+            with self.get_connection() as conn:
+                cursor = conn.executemany(UPSERT_DEVICE_SQL, rows)
+            self._devices_cache = {}
+
+            logger.info("Registered %d devices", cursor.rowcount)
+            return cursor.rowcount
+
+        except Exception as e:
+            logger.error("Failed to register devices: %s", e)
+            return 0
+
     def get_device(self, device_id: str) -> Optional[Dict[str, Any]]:
         """Get device by ID"""
         with self.get_connection() as conn:
@@ -128,26 +348,94 @@ class DatabaseManager:
 
             return dict(row) if row else None
 
-    def get_enabled_devices(self, device_type: str = None) -> List[Dict[str, Any]]:
+    def get_enabled_devices(
+        self,
+        device_type: str = None,
+        columns: List[str] = None,
+        max_age: float = 0
+    ) -> List[Dict[str, Any]]:
         """
         Get all enabled devices
 
         Args:
             device_type: Filter by device type (optional)
+            columns: Columns to select (optional, default all). Polling
+                     callers should pass only what they need, e.g.
+                     ['device_id', 'modbus_address'], to skip wide
+                     columns like metadata
+            max_age: Reuse a result read less than this many seconds ago
+                     (0 always queries). Device writes made through this
+                     manager drop the cached results.
 
         Returns:
             List of device dictionaries
         """
+        key = (device_type, tuple(columns) if columns else None)
+        cached = self._devices_cache.get(key)
+        if max_age > 0 and cached and time.monotonic() - cached[0] < max_age:
+            return copy.deepcopy(cached[1])
+
+        devices = list(self.iter_enabled_devices(device_type, columns))
+        if max_age <= 0:
+            return devices
+
+        # Only callers that read from the cache pay for keeping it
+        self._devices_cache[key] = (time.monotonic(), devices)
+        return copy.deepcopy(devices)
+
+    def iter_enabled_devices(
+        self,
+        device_type: str = None,
+        columns: List[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate enabled devices as they are read from the cursor
+
+        Reads through the calling thread's connection while iterating.
+
+        Args:
+            device_type: Filter by device type (optional)
+            columns: Columns to select (optional, default all)
+
+        Yields:
+            Device dictionaries
+        """
+        if columns:
+            if not all(column.isidentifier() for column in columns):
+                raise ValueError(f"Invalid column list: {columns}")
+            select = ', '.join(columns)
+        else:
+            select = '*'
+
         with self.get_connection() as conn:
             if device_type:
-                rows = conn.execute(
-                    "SELECT * FROM devices WHERE enabled = 1 AND device_type = ?",
+                yield from self._iter_dicts(
+                    conn,
+                    f"SELECT {select} FROM devices WHERE enabled = 1 AND device_type = ?",
                     (device_type,)
-                ).fetchall()
+                )
             else:
-                rows = conn.execute(
-                    "SELECT * FROM devices WHERE enabled = 1"
-                ).fetchall()
+                yield from self._iter_dicts(
+                    conn,
+                    f"SELECT {select} FROM devices WHERE enabled = 1"
+                )
+
+    def get_pzem_mapping(self) -> List[Dict[str, Any]]:
+        """
+        Get enabled PZEM devices that have a Modbus address
+
+        Returns:
+            List of dicts with modbus_address, device_id, device_name, location
+        """
+        with self.get_connection() as conn:
+            rows = conn.execute("""
+                SELECT modbus_address, device_id, device_name, location
+                FROM devices
+                WHERE device_type = 'pzem'
+                AND enabled = 1
+                AND modbus_address IS NOT NULL
+                ORDER BY modbus_address
+            """).fetchall()
 
             return [dict(row) for row in rows]
 
@@ -194,11 +482,12 @@ class DatabaseManager:
 
             with self.get_connection() as conn:
                 conn.execute(query, params)
+            self._devices_cache = {}
 
             return True
 
         except Exception as e:
-            logger.error(f"Failed to update device status {device_id}: {e}")
+            logger.error("Failed to update device status %s: %s", device_id, e)
             return False
 
     # ============================================================================
@@ -216,103 +505,276 @@ class DatabaseManager:
         Returns:
             True if successful
         """
+        return self.insert_pzem_data_many([(device_id, reading)]) == 1
+
+    def insert_pzem_data_many(self, records: List[Tuple[str, Any]]) -> int:
+        """
+        Insert many PZEM readings in a single transaction
+
+        Args:
+            records: List of (device_id, reading) pairs, where reading is a
+                     PZEMReading object or dict from PZEM reader
+
+        Returns:
+            Number of rows inserted (0 on failure)
+        """
         try:
-            # Handle both dict and object input
-            if isinstance(reading, dict):
-                # Dict from pzem_pigpio_reader
-                modbus_address = reading.get('modbus_address', 1)
-                voltage = reading.get('voltage', 0)
-                current = reading.get('current', 0)
-                power = reading.get('power', 0)
-                energy = reading.get('energy', 0)  # kWh (no conversion)
-                frequency = reading.get('frequency', None)
-                power_factor = reading.get('power_factor', None)
-                read_quality = reading.get('read_quality', 100)
-                error_code = reading.get('error_code', 0)
-                timestamp = reading.get('timestamp', datetime.utcnow().isoformat() + 'Z')
-            else:
-                # Object (PZEMReading dataclass)
-                modbus_address = reading.modbus_address
-                voltage = reading.voltage
-                current = reading.current
-                power = reading.power
-                energy = reading.energy  # kWh (no conversion)
-                frequency = getattr(reading, 'frequency', None)
-                power_factor = getattr(reading, 'power_factor', None)
-                read_quality = getattr(reading, 'read_quality', 100)
-                error_code = getattr(reading, 'error_code', 0)
-                timestamp = getattr(reading, 'timestamp', datetime.utcnow().isoformat() + 'Z')
+            rows = [self._pzem_row(device_id, reading) for device_id, reading in records]
+
+            if not rows:
+                return 0
 
             with self.get_connection() as conn:
-                conn.execute("""
-                    INSERT INTO pzem_data (
-                        device_id, modbus_address, voltage, current, power,
-                        energy, frequency, power_factor, read_quality,
-                        error_code, timestamp
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    device_id,
-                    modbus_address,
-                    voltage,
-                    current,
-                    power,
-                    energy,  # kWh
-                    frequency,  # NULL for PZEM-017 DC
-                    power_factor,  # NULL for PZEM-017 DC
-                    read_quality,
-                    error_code,
-                    timestamp
-                ))
+                conn.executemany(INSERT_PZEM_SQL, rows)
 
-            return True
+            return len(rows)
 
         except Exception as e:
-            logger.error(f"Failed to insert PZEM data for {device_id}: {e}")
-            return False
+            if len(records) == 1:
+                logger.error("Failed to insert PZEM data for %s: %s", records[0][0], e)
+            else:
+                logger.error("Failed to insert %d PZEM records: %s", len(records), e)
+            return 0
+
+    def bulk_load_pzem_data(self, records: List[Tuple[str, Any]]) -> int:
+        """
+        Insert a large backlog of PZEM readings (e.g. offline catch-up)
+
+        Above BULK_LOAD_THRESHOLD rows the pzem_data indexes are dropped,
+        rows are inserted with synchronous=OFF and the indexes are rebuilt
+        in one pass, all within one transaction. Smaller batches use
+        insert_pzem_data_many().
+
+        Args:
+            records: List of (device_id, reading) pairs
+
+        Returns:
+            Number of rows inserted (0 on failure)
+        """
+        if len(records) <= BULK_LOAD_THRESHOLD:
+            return self.insert_pzem_data_many(records)
+
+        indexes = [(name, sql) for table, name, sql in INDEXES if table == 'pzem_data']
+
+        try:
+            rows = [self._pzem_row(device_id, reading) for device_id, reading in records]
+
+            with self.get_connection() as conn:
+                conn.execute("PRAGMA synchronous = OFF")
+                try:
+                    conn.execute("BEGIN")
+                    for index_name, _ in indexes:
+                        conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+                    conn.executemany(INSERT_PZEM_SQL, rows)
+                    for _, index_sql in indexes:
+                        conn.execute(index_sql)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.execute("PRAGMA synchronous = NORMAL")
+
+            logger.info("Bulk loaded %d PZEM records", len(rows))
+            return len(rows)
+
+        except Exception as e:
+            logger.error("Failed to bulk load %d PZEM records: %s", len(records), e)
+            return 0
+
+    @staticmethod
+    def _pzem_row(device_id: str, reading) -> tuple:
+        """Build a pzem_data row from a PZEMReading object or dict"""
+        # Handle both dict and object input
+        if isinstance(reading, dict):
+            # Dict from pzem_pigpio_reader
+            modbus_address = reading.get('modbus_address', 1)
+            voltage = reading.get('voltage', 0)
+            current = reading.get('current', 0)
+            power = reading.get('power', 0)
+            energy = reading.get('energy', 0)  # kWh (no conversion)
+            frequency = reading.get('frequency', None)
+            power_factor = reading.get('power_factor', None)
+            read_quality = reading.get('read_quality', 100)
+            error_code = reading.get('error_code', 0)
+            timestamp = reading.get('timestamp')
+        else:
+            # Object (PZEMReading dataclass)
+            modbus_address = reading.modbus_address
+            voltage = reading.voltage
+            current = reading.current
+            power = reading.power
+            energy = reading.energy  # kWh (no conversion)
+            frequency = getattr(reading, 'frequency', None)
+            power_factor = getattr(reading, 'power_factor', None)
+            read_quality = getattr(reading, 'read_quality', 100)
+            error_code = getattr(reading, 'error_code', 0)
+            timestamp = getattr(reading, 'timestamp', None)
+
+        return (
+            device_id,
+            modbus_address,
+            voltage,
+            current,
+            power,
+            energy,  # kWh
+            frequency,  # NULL for PZEM-017 DC
+            power_factor,  # NULL for PZEM-017 DC
+            read_quality,
+            error_code,
+            timestamp
+        )
 
     def get_pending_pzem_data(self, limit: int = 100) -> List[Dict[str, Any]]:
         """Get pending PZEM data for upload"""
         with self.get_connection() as conn:
-            rows = conn.execute("""
+            return list(self._iter_dicts(conn, """
                 SELECT * FROM pzem_data
                 WHERE uploaded = 0
                 ORDER BY timestamp ASC
                 LIMIT ?
-            """, (limit,)).fetchall()
-
-            return [dict(row) for row in rows]
+            """, (limit,)))
 
     def mark_pzem_uploaded(self, record_ids: List[int]) -> bool:
         """Mark PZEM records as uploaded"""
         try:
+            # Bind ids as one JSON array: constant SQL text, no parameter limit
+            ids_json = _json_dumps(list(record_ids))
+            with self.get_connection() as conn:
+                conn.execute(
+                    "UPDATE pzem_data SET uploaded = 1 "
+                    "WHERE id IN (SELECT value FROM json_each(?))",
+                    (ids_json,)
+                )
+                conn.execute(
+                    "DELETE FROM pzem_upload_claims "
+                    "WHERE id IN (SELECT value FROM json_each(?))",
+                    (ids_json,)
+                )
+            return True
+        except Exception as e:
+            logger.error("Failed to mark PZEM data as uploaded: %s", e)
+            return False
+
+    def claim_pending_pzem_data(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Fetch pending PZEM data and mark it in flight in one transaction
+
+        Claimed rows are invisible to other uploaders. Once the server has
+        accepted them call mark_pzem_uploaded(); if the upload fails, hand
+        the ids back with unclaim_pzem_data().
+
+        Args:
+            limit: Maximum number of records to claim
+
+        Returns:
+            Claimed records, oldest first, as get_pending_pzem_data()
+            returns them (i.e. as they were before the claim)
+        """
+        with self.get_connection() as conn:
+            # Take the write lock first so concurrent claims cannot overlap
+            conn.execute("BEGIN IMMEDIATE")
+            records = list(self._iter_dicts(conn, """
+                SELECT * FROM pzem_data
+                WHERE uploaded = 0
+                ORDER BY timestamp ASC
+                LIMIT ?
+            """, (limit,)))
+
+            if records:
+                ids_json = _json_dumps([r['id'] for r in records])
+                conn.execute(
+                    "UPDATE pzem_data SET uploaded = ? "
+                    "WHERE id IN (SELECT value FROM json_each(?))",
+                    (UPLOAD_IN_FLIGHT, ids_json)
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO pzem_upload_claims (id, claimed_at) "
+                    "SELECT value, ? FROM json_each(?)",
+                    (time.time(), ids_json)
+                )
+
+        return records
+
+    def unclaim_pzem_data(self, record_ids: List[int]) -> bool:
+        """Return claimed PZEM records to the pending state"""
+        try:
+            ids_json = _json_dumps(list(record_ids))
             with self.get_connection() as conn:
-                placeholders = ','.join('?' * len(record_ids))
                 conn.execute(
-                    f"UPDATE pzem_data SET uploaded = 1 WHERE id IN ({placeholders})",
-                    record_ids
+                    "UPDATE pzem_data SET uploaded = 0 "
+                    "WHERE id IN (SELECT value FROM json_each(?))",
+                    (ids_json,)
+                )
+                conn.execute(
+                    "DELETE FROM pzem_upload_claims "
+                    "WHERE id IN (SELECT value FROM json_each(?))",
+                    (ids_json,)
                 )
             return True
         except Exception as e:
-            logger.error(f"Failed to mark PZEM data as uploaded: {e}")
+            logger.error("Failed to unclaim PZEM data: %s", e)
             return False
 
+    def release_pzem_claims(self, max_age: float = STALE_CLAIM_AGE) -> int:
+        """
+        Return stale in-flight PZEM records to the pending state
+
+        Uploaders call this at the start of every cycle, so claims left by a
+        process that died mid-upload are picked up again once they are
+        older than max_age. Younger claims may belong to an upload still
+        running in another process and are kept. A claim time in the future
+        (the clock moved back, e.g. fake-hwclock after a power loss) means
+        its age is unknown, so it is treated as stale.
+
+        Args:
+            max_age: Release claims made more than this many seconds ago
+
+        Returns:
+            Number of records released
+        """
+        now = time.time()
+        cutoff = now - max_age
+        try:
+            with self.get_connection() as conn:
+                # In-flight rows without a claim entry are stale too
+                cursor = conn.execute("""
+                    UPDATE pzem_data SET uploaded = 0
+                    WHERE uploaded = ? AND id NOT IN (
+                        SELECT id FROM pzem_upload_claims
+                        WHERE claimed_at BETWEEN ? AND ?
+                    )
+                """, (UPLOAD_IN_FLIGHT, cutoff, now))
+                conn.execute(
+                    "DELETE FROM pzem_upload_claims WHERE claimed_at NOT BETWEEN ? AND ?",
+                    (cutoff, now)
+                )
+            return cursor.rowcount
+        except Exception as e:
+            logger.error("Failed to release PZEM claims: %s", e)
+            return 0
+
     # ============================================================================
     # WEATHER DATA
     # ============================================================================
 
     def insert_weather_data(self, device_id: str, data: Dict[str, Any]) -> bool:
         """Insert weather station data"""
+        return self.insert_weather_data_many([(device_id, data)]) == 1
+
+    def insert_weather_data_many(self, records: List[Tuple[str, Dict[str, Any]]]) -> int:
+        """
+        Insert many weather station readings in a single transaction
+
+        Args:
+            records: List of (device_id, data) pairs
+
+        Returns:
+            Number of rows inserted (0 on failure)
+        """
         try:
-            with self.get_connection() as conn:
-                conn.execute("""
-                    INSERT INTO weather_data (
-                        device_id, temperature_outdoor, temperature_indoor,
-                        humidity_outdoor, humidity_indoor, pressure,
-                        wind_speed, wind_direction, wind_gust,
-                        rain_rate, rain_daily, rain_total,
-                        uv_index, light_intensity, extra_data, timestamp
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
+            rows = [
+                (
                     device_id,
                     data.get('temperature_outdoor'),
                     data.get('temperature_indoor'),
@@ -327,13 +789,63 @@ class DatabaseManager:
                     data.get('rain_total'),
                     data.get('uv_index'),
                     data.get('light_intensity'),
-                    json.dumps(data.get('extra_data', {})),
-                    data.get('timestamp', datetime.utcnow().isoformat() + 'Z')
-                ))
-            return True
+                    _json_dumps(data.get('extra_data', {})),
+                    data.get('timestamp')
+                )
+                for device_id, data in records
+            ]
+
+            if not rows:
+                return 0
+
+            with self.get_connection() as conn:
+                conn.executemany("""
+                    INSERT INTO weather_data (
+                        device_id, temperature_outdoor, temperature_indoor,
+                        humidity_outdoor, humidity_indoor, pressure,
+                        wind_speed, wind_direction, wind_gust,
+                        rain_rate, rain_daily, rain_total,
+                        uv_index, light_intensity, extra_data, timestamp
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                              COALESCE(?, strftime('%Y-%m-%dT%H:%M:%fZ', 'now')))
+                """, rows)
+
+            return len(rows)
+
         except Exception as e:
-            logger.error(f"Failed to insert weather data: {e}")
-            return False
+            if len(records) == 1:
+                logger.error("Failed to insert weather data for %s: %s", records[0][0], e)
+            else:
+                logger.error("Failed to insert %d weather records: %s", len(records), e)
+            return 0
+
+    def get_pending_weather_extra(self, field: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Get one extra_data field from pending weather records
+
+        The value is extracted by SQLite (JSON1) so the extra_data blob is
+        never decoded in Python.
+
+        Args:
+            field: Top-level key in extra_data (must be a valid identifier)
+            limit: Maximum number of records
+
+        Returns:
+            List of dicts with id, device_id, timestamp and value
+        """
+        # Spliced into a JSON path, so only plain keys are accepted
+        if not field.isidentifier():
+            raise ValueError(f"Invalid extra_data field: {field}")
+
+        with self.get_connection() as conn:
+            return list(self._iter_dicts(conn, """
+                SELECT id, device_id, timestamp,
+                       json_extract(extra_data, ?) as value
+                FROM weather_data
+                WHERE uploaded = 0
+                ORDER BY timestamp ASC
+                LIMIT ?
+            """, (f'$."{field}"', limit)))
 
     # ============================================================================
     # BATTERY MONITORING VIA PZEM
@@ -367,11 +879,11 @@ class DatabaseManager:
                     error_type,
                     error_message,
                     error_code,
-                    json.dumps(extra_info) if extra_info else None
+                    _json_dumps(extra_info) if extra_info else None
                 ))
             return True
         except Exception as e:
-            logger.error(f"Failed to log device error: {e}")
+            logger.error("Failed to log device error: %s", e)
             return False
 
     def log_system(
@@ -394,11 +906,11 @@ class DatabaseManager:
                     module,
                     message,
                     device_id,
-                    json.dumps(extra_info) if extra_info else None
+                    _json_dumps(extra_info) if extra_info else None
                 ))
             return True
         except Exception as e:
-            logger.error(f"Failed to log system event: {e}")
+            logger.error("Failed to log system event: %s", e)
             return False
 
     # ============================================================================
@@ -428,7 +940,7 @@ class DatabaseManager:
                 ))
             return True
         except Exception as e:
-            logger.error(f"Failed to log upload: {e}")
+            logger.error("Failed to log upload: %s", e)
             return False
 
     # ============================================================================
@@ -454,7 +966,7 @@ class DatabaseManager:
                 """, (key, value))
             return True
         except Exception as e:
-            logger.error(f"Failed to set config {key}: {e}")
+            logger.error("Failed to set config %s: %s", key, e)
             return False
 
     # ============================================================================
@@ -488,6 +1000,35 @@ class DatabaseManager:
 
             return row['count'] if row else 0
 
+    def get_pending_counts(self) -> Dict[str, int]:
+        """
+        Get pending upload counts for every data type in one query
+
+        Returns:
+            Dictionary of data type -> pending record count (0 for data
+            types whose table doesn't exist)
+        """
+        counts = {data_type: 0 for data_type in DATA_TABLES}
+
+        with self.get_connection() as conn:
+            existing_table_names = {
+                row['name'] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type='table'"
+                )
+            }
+
+            selects = [
+                f"SELECT '{data_type}', COUNT(*) FROM {table_name} WHERE uploaded = 0"
+                for data_type, table_name in DATA_TABLES.items()
+                if table_name in existing_table_names
+            ]
+
+            if selects:
+                for data_type, count in conn.execute(' UNION ALL '.join(selects)):
+                    counts[data_type] = count
+
+        return counts
+
     # ============================================================================
     # DATA CLEANUP
     # ============================================================================
@@ -496,7 +1037,10 @@ class DatabaseManager:
         self,
         data_type: str,
         days_old: int = 7,
-        dry_run: bool = False
+        dry_run: bool = False,
+        batch_size: int = CLEANUP_BATCH_SIZE,
+        batch_pause: float = CLEANUP_BATCH_PAUSE,
+        stop_event: Optional[threading.Event] = None
     ) -> Dict[str, Any]:
         """
         Delete uploaded data older than specified days
@@ -505,23 +1049,25 @@ class DatabaseManager:
             data_type: Type of data ('pzem', 'weather', 'mqtt', 'battery')
             days_old: Delete data older than this many days
             dry_run: If True, only count records without deleting
+            batch_size: Rows deleted per transaction (0 deletes everything
+                        in one statement)
+            batch_pause: Seconds to sleep between batches so writers on
+                         other connections can take the lock
+            stop_event: If set while deleting, stop after the current
+                        batch (already deleted batches stay committed)
 
         Returns:
             Dictionary with deletion statistics
         """
         try:
-            table_map = {
-                'pzem': 'pzem_data',
-                'weather': 'weather_data',
-                'mqtt': 'mqtt_data',
-                'battery': 'battery_data'
-            }
-
-            if data_type not in table_map:
-                logger.error(f"Invalid data_type: {data_type}")
+            if data_type not in DATA_TABLES:
+                logger.error("Invalid data_type: %s", data_type)
                 return {'error': 'Invalid data_type'}
 
-            table_name = table_map[data_type]
+            table_name = DATA_TABLES[data_type]
+
+            # Bound as a parameter so the statement text stays constant
+            age = f'-{int(days_old)} days'
 
             with self.get_connection() as conn:
                 # Check if table exists
@@ -531,7 +1077,7 @@ class DatabaseManager:
                 ).fetchone()
 
                 if not table_check:
-                    logger.debug(f"Table {table_name} does not exist, skipping")
+                    logger.debug("Table %s does not exist, skipping", table_name)
                     return {
                         'data_type': data_type,
                         'records_deleted': 0,
@@ -539,74 +1085,115 @@ class DatabaseManager:
                         'skipped': True
                     }
 
-                # Count records to be deleted
-                count_query = f"""
-                    SELECT COUNT(*) as count
-                    FROM {table_name}
-                    WHERE uploaded = 1
-                    AND timestamp < datetime('now', '-{days_old} days')
-                """
-                count_row = conn.execute(count_query).fetchone()
-                records_count = count_row['count'] if count_row else 0
+                where = (
+                    f"FROM {table_name} "
+                    "WHERE uploaded = 1 AND timestamp < datetime('now', ?)"
+                )
+
+                if batch_size:
+                    delete_sql = (
+                        f"DELETE FROM {table_name} WHERE rowid IN "
+                        f"(SELECT rowid {where} LIMIT ?)"
+                    )
+                    delete_params = (age, batch_size)
+                else:
+                    delete_sql = f"DELETE {where}"
+                    delete_params = (age,)
+
+                if dry_run or not SQLITE_HAS_RETURNING:
+                    # Count and timestamp range in one pass
+                    row = conn.execute(
+                        f"SELECT COUNT(*) as count, MIN(timestamp) as oldest, "
+                        f"MAX(timestamp) as newest {where}",
+                        (age,)
+                    ).fetchone()
+                    records_count = row['count']
+                    oldest, newest = row['oldest'], row['newest']
+
+                    if not dry_run and records_count:
+                        records_count = 0
+                        while True:
+                            deleted = conn.execute(delete_sql, delete_params).rowcount
+                            records_count += deleted
+                            if not batch_size or deleted < batch_size:
+                                break
+                            conn.commit()
+                            if self._cleanup_stopped(batch_pause, stop_event):
+                                break
+                else:
+                    # Delete and collect stats from the deleted rows in one pass
+                    records_count = 0
+                    oldest = newest = None
+                    while True:
+                        deleted = 0
+                        for row in conn.execute(f"{delete_sql} RETURNING timestamp", delete_params):
+                            timestamp = row[0]
+                            deleted += 1
+                            if oldest is None or timestamp < oldest:
+                                oldest = timestamp
+                            if newest is None or timestamp > newest:
+                                newest = timestamp
+
+                        records_count += deleted
+                        if not batch_size or deleted < batch_size:
+                            break
+                        conn.commit()
+                        if self._cleanup_stopped(batch_pause, stop_event):
+                            break
 
                 if records_count == 0:
-                    logger.info(f"No {data_type} records to delete (older than {days_old} days)")
+                    logger.debug("No %s records to delete (older than %s days)", data_type, days_old)
                     return {
                         'data_type': data_type,
                         'records_deleted': 0,
                         'dry_run': dry_run
                     }
 
-                # Get timestamp range
-                range_query = f"""
-                    SELECT
-                        MIN(timestamp) as oldest,
-                        MAX(timestamp) as newest
-                    FROM {table_name}
-                    WHERE uploaded = 1
-                    AND timestamp < datetime('now', '-{days_old} days')
-                """
-                range_row = conn.execute(range_query).fetchone()
-
                 if not dry_run:
-                    # Actually delete the records
-                    delete_query = f"""
-                        DELETE FROM {table_name}
-                        WHERE uploaded = 1
-                        AND timestamp < datetime('now', '-{days_old} days')
-                    """
-                    conn.execute(delete_query)
+                    self._stats_cache = None
                     logger.info(
-                        f"Deleted {records_count} {data_type} records "
-                        f"older than {days_old} days"
+                        "Deleted %d %s records older than %s days",
+                        records_count, data_type, days_old
                     )
                 else:
                     logger.info(
-                        f"DRY RUN: Would delete {records_count} {data_type} records "
-                        f"older than {days_old} days"
+                        "DRY RUN: Would delete %d %s records older than %s days",
+                        records_count, data_type, days_old
                     )
 
                 return {
                     'data_type': data_type,
                     'records_deleted': records_count,
                     'days_old': days_old,
-                    'oldest_timestamp': dict(range_row)['oldest'] if range_row else None,
-                    'newest_timestamp': dict(range_row)['newest'] if range_row else None,
+                    'oldest_timestamp': oldest,
+                    'newest_timestamp': newest,
                     'dry_run': dry_run
                 }
 
         except Exception as e:
-            logger.error(f"Failed to delete {data_type} data: {e}")
+            logger.error("Failed to delete %s data: %s", data_type, e)
             return {
                 'error': str(e),
                 'data_type': data_type,
                 'records_deleted': 0
             }
 
+    @staticmethod
+    def _cleanup_stopped(batch_pause: float, stop_event: Optional[threading.Event]) -> bool:
+        """Pause between cleanup batches; True if stop_event was set"""
+        if stop_event is not None:
+            return stop_event.wait(batch_pause)
+        if batch_pause:
+            time.sleep(batch_pause)
+        return False
+
     def cleanup_all_uploaded_data(
         self,
         days_old: int = 7,
-        dry_run: bool = False
+        dry_run: bool = False,
+        batch_size: int = CLEANUP_BATCH_SIZE,
+        batch_pause: float = CLEANUP_BATCH_PAUSE,
+        stop_event: Optional[threading.Event] = None
     ) -> Dict[str, Any]:
         """
         Cleanup all uploaded data older than specified days
@@ -614,12 +1201,16 @@ class DatabaseManager:
         Args:
             days_old: Delete data older than this many days
             dry_run: If True, only count records without deleting
+            batch_size: Rows deleted per transaction (0 for no limit)
+            batch_pause: Seconds to sleep between batches
+            stop_event: If set, stop after the current batch and skip the
+                        remaining data types
 
         Returns:
             Dictionary with cleanup statistics for all data types
         """
         logger.info("=" * 60)
-        logger.info(f"Starting cleanup: data older than {days_old} days")
+        logger.info("Starting cleanup: data older than %s days", days_old)
         if dry_run:
             logger.info("DRY RUN MODE - No data will be deleted")
         logger.info("=" * 60)
@@ -632,8 +1223,13 @@ class DatabaseManager:
         }
 
         # Cleanup each data type
-        for data_type in ['pzem', 'weather', 'mqtt', 'battery']:
-            result = self.delete_uploaded_data(data_type, days_old, dry_run)
+        for data_type in DATA_TABLES:
+            if stop_event is not None and stop_event.is_set():
+                logger.info("Cleanup interrupted, skipping remaining data types")
+                break
+            result = self.delete_uploaded_data(
+                data_type, days_old, dry_run, batch_size, batch_pause, stop_event
+            )
             results['data_types'][data_type] = result
             results['total_records_deleted'] += result.get('records_deleted', 0)
 
@@ -647,74 +1243,71 @@ class DatabaseManager:
             )
 
         logger.info("=" * 60)
-        logger.info(f"Cleanup complete: {results['total_records_deleted']} records deleted")
+        logger.info("Cleanup complete: %d records deleted", results['total_records_deleted'])
         logger.info("=" * 60)
 
         return results
 
-    def get_cleanup_stats(self) -> Dict[str, Any]:
+    def get_cleanup_stats(self, max_age: float = 0) -> Dict[str, Any]:
         """
         Get statistics about data that can be cleaned up
 
+        Args:
+            max_age: Reuse stats computed less than this many seconds ago
+                     (0 always queries the database)
+
         Returns:
             Dictionary with cleanup statistics
         """
+        cached = self._stats_cache
+        if max_age > 0 and cached and time.monotonic() - cached[0] < max_age:
+            return copy.deepcopy(cached[1])
+
         stats = {
             'total_uploaded': 0,
             'total_pending': 0,
             'by_data_type': {}
         }
 
+        for data_type in DATA_TABLES:
+            stats['by_data_type'][data_type] = {
+                'uploaded': 0,
+                'pending': 0,
+                'oldest_uploaded': None
+            }
+
         with self.get_connection() as conn:
             # Check which tables exist
-            existing_tables = conn.execute(
-                "SELECT name FROM sqlite_master WHERE type='table'"
-            ).fetchall()
-            existing_table_names = [t['name'] for t in existing_tables]
-
-            # Stats for each data type
-            for data_type, table_name in [
-                ('pzem', 'pzem_data'),
-                ('weather', 'weather_data'),
-                ('mqtt', 'mqtt_data'),
-                ('battery', 'battery_data')
-            ]:
-                # Skip if table doesn't exist
-                if table_name not in existing_table_names:
-                    stats['by_data_type'][data_type] = {
-                        'uploaded': 0,
-                        'pending': 0,
-                        'oldest_uploaded': None
-                    }
-                    continue
-
-                # Count uploaded records
-                uploaded_row = conn.execute(
-                    f"SELECT COUNT(*) as count FROM {table_name} WHERE uploaded = 1"
-                ).fetchone()
-
-                # Count pending records
-                pending_row = conn.execute(
-                    f"SELECT COUNT(*) as count FROM {table_name} WHERE uploaded = 0"
-                ).fetchone()
-
-                # Oldest uploaded record
-                oldest_row = conn.execute(
-                    f"""SELECT MIN(timestamp) as oldest
-                        FROM {table_name}
-                        WHERE uploaded = 1"""
-                ).fetchone()
+            existing_table_names = {
+                row['name'] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type='table'"
+                )
+            }
 
-                uploaded_count = uploaded_row['count'] if uploaded_row else 0
-                pending_count = pending_row['count'] if pending_row else 0
+            # One aggregate per existing table, combined into a single query
+            selects = [
+                f"""SELECT '{data_type}' as data_type,
+                        COALESCE(SUM(uploaded = 1), 0) as uploaded,
+                        COALESCE(SUM(uploaded = 0), 0) as pending,
+                        MIN(CASE WHEN uploaded = 1 THEN timestamp END) as oldest_uploaded
+                    FROM {table_name}"""
+                for data_type, table_name in DATA_TABLES.items()
+                if table_name in existing_table_names
+            ]
+
+            if selects:
+                for row in conn.execute(' UNION ALL '.join(selects)):
+                    stats['by_data_type'][row['data_type']] = {
+                        'uploaded': row['uploaded'],
+                        'pending': row['pending'],
+                        'oldest_uploaded': row['oldest_uploaded']
+                    }
 
-                stats['by_data_type'][data_type] = {
-                    'uploaded': uploaded_count,
-                    'pending': pending_count,
-                    'oldest_uploaded': dict(oldest_row)['oldest'] if oldest_row else None
-                }
+                    stats['total_uploaded'] += row['uploaded']
+                    stats['total_pending'] += row['pending']
 
-                stats['total_uploaded'] += uploaded_count
-                stats['total_pending'] += pending_count
+        if max_age <= 0:
+            return stats
 
-        return stats
+        self._stats_cache = (time.monotonic(), stats)
+        return copy.deepcopy(stats)
@@ -4,7 +4,9 @@ Weather Station & Energy Monitor System
 Main entry point for starting all services
 """
 
+import os
 import sys
+import importlib
 import subprocess
 import argparse
 from pathlib import Path
@@ -130,32 +132,27 @@ def register_device_interactive():
         return 1
 
 
+# Services started as `<module>.main()` with `-c <config>`:
+# name -> (module, program name for sys.argv, accepts --test)
+# Modules are imported only when their service is selected.
+_SERVICES = {
+    'pzem': ('weatherstation.sensors.pzem_reader', 'pzem_reader', True),
+    'upload': ('weatherstation.services.upload_service', 'upload_service', True),
+    'weather': ('weatherstation.sensors.weather_station', 'weather_station', False),
+    'mqtt': ('weatherstation.sensors.mqtt_subscriber', 'mqtt_subscriber', False),
+}
+
+
 def run_service(service: str, config: str, test_mode: bool = False):
     """Run specified service"""
 
-    if service == 'pzem':
-        from weatherstation.sensors.pzem_reader import main as pzem_main
-        sys.argv = ['pzem_reader', '-c', config]
-        if test_mode:
+    if service in _SERVICES:
+        module_name, prog, takes_test = _SERVICES[service]
+        module = importlib.import_module(module_name)
+        sys.argv = [prog, '-c', config]
+        if test_mode and takes_test:
             sys.argv.append('--test')
-        return pzem_main()
-
-    elif service == 'upload':
-        from weatherstation.services.upload_service import main as upload_main
-        sys.argv = ['upload_service', '-c', config]
-        if test_mode:
-            sys.argv.append('--test')
-        return upload_main()
-
-    elif service == 'weather':
-        from weatherstation.sensors.weather_station import main as weather_main
-        sys.argv = ['weather_station', '-c', config]
-        return weather_main()
-
-    elif service == 'mqtt':
-        from weatherstation.sensors.mqtt_subscriber import main as mqtt_main
-        sys.argv = ['mqtt_subscriber', '-c', config]
-        return mqtt_main()
+        return module.main()
 
     elif service == 'cleanup':
         from weatherstation.services.cleanup_service import main as cleanup_main
@@ -172,32 +169,48 @@ def run_service(service: str, config: str, test_mode: bool = False):
         return 1
 
     elif service == 'all':
-        logger.warning("Running all services in one process (testing only!)")
+        logger.warning("Running all services from one command (testing only!)")
         logger.warning("For production, use systemd services")
 
-        # This is just for testing - not recommended for production
-        import threading
+        # This is just for testing - not recommended for production.
+        # Each service gets its own process (own interpreter/GIL and its own
+        # sys.argv, which every service main() parses)
+        import multiprocessing
 
         services = ['pzem', 'upload', 'weather', 'mqtt']
 
-        threads = []
-        for svc in services:
-            thread = threading.Thread(
+        # Give each service its own core when there are enough of them;
+        # otherwise leave placement to the scheduler
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+        pin = len(cpus) >= len(services)
+
+        processes = []
+        for i, svc in enumerate(services):
+            process = multiprocessing.Process(
                 target=run_service,
                 args=(svc, config, False),
+                name=svc,
                 daemon=True
             )
-            thread.start()
-            threads.append(thread)
-            logger.info(f"Started {svc} service in thread")
+            process.start()
+            processes.append(process)
+            if pin:
+                os.sched_setaffinity(process.pid, {cpus[i]})
+                logger.info("Started %s service in process %d (CPU %d)", svc, process.pid, cpus[i])
+            else:
+                logger.info("Started %s service in process %d", svc, process.pid)
 
         logger.info("All services started. Press Ctrl+C to stop.")
 
         try:
-            for thread in threads:
-                thread.join()
+            for process in processes:
+                process.join()
         except KeyboardInterrupt:
             logger.info("Stopping all services...")
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join(timeout=5)
 
         return 0
 
@@ -4,12 +4,14 @@ Data Cleanup Service
 Cleans up uploaded data older than specified days
 """
 
-import time
+import copy
+import signal
 import argparse
+import threading
 from datetime import datetime
 from typing import Dict, Any
 
-from weatherstation.database.db_manager import DatabaseManager
+from weatherstation.database.db_manager import DatabaseManager, CLEANUP_BATCH_SIZE
 from weatherstation.utils.logger import get_logger, setup_logging
 
 logger = get_logger(__name__)
@@ -24,7 +26,8 @@ class CleanupService:
         self,
         db_path: str = './data/weatherstation.db',
         days_old: int = 7,
-        run_once: bool = False
+        run_once: bool = False,
+        batch_size: int = CLEANUP_BATCH_SIZE
     ):
         """
         Initialize cleanup service
@@ -33,38 +36,44 @@ class CleanupService:
             db_path: Path to database
             days_old: Delete data older than this many days
             run_once: If True, run once and exit. If False, run continuously
+            batch_size: Rows deleted per transaction (0 for no limit)
         """
         self.db = DatabaseManager(db_path)
         self.days_old = days_old
+        self.batch_size = batch_size
         self.run_once = run_once
         self.running = False
+        self._stop_event = threading.Event()  # Wakes the loop's wait on stop()
 
-        logger.info(f"Cleanup Service initialized")
-        logger.info(f"Database: {db_path}")
-        logger.info(f"Cleanup threshold: {days_old} days")
-        logger.info(f"Mode: {'One-time' if run_once else 'Continuous'}")
+        logger.info("Cleanup Service initialized")
+        logger.info("Database: %s", db_path)
+        logger.info("Cleanup threshold: %s days", days_old)
+        logger.info("Mode: %s", 'One-time' if run_once else 'Continuous')
 
     def print_stats(self):
         """Print current database statistics"""
-        logger.info("=" * 60)
-        logger.info("Database Statistics")
-        logger.info("=" * 60)
-
         stats = self.db.get_cleanup_stats()
 
-        logger.info(f"Total Uploaded: {stats['total_uploaded']} records")
-        logger.info(f"Total Pending:  {stats['total_pending']} records")
-        logger.info("")
+        # Built as one block so it is written with a single log call
+        lines = [
+            "=" * 60,
+            "Database Statistics",
+            "=" * 60,
+            f"Total Uploaded: {stats['total_uploaded']} records",
+            f"Total Pending:  {stats['total_pending']} records",
+            "",
+        ]
 
         for data_type, type_stats in stats['by_data_type'].items():
-            logger.info(f"{data_type.upper()}:")
-            logger.info(f"  Uploaded: {type_stats['uploaded']}")
-            logger.info(f"  Pending:  {type_stats['pending']}")
+            lines.append(f"{data_type.upper()}:")
+            lines.append(f"  Uploaded: {type_stats['uploaded']}")
+            lines.append(f"  Pending:  {type_stats['pending']}")
             if type_stats['oldest_uploaded']:
-                logger.info(f"  Oldest:   {type_stats['oldest_uploaded']}")
-            logger.info("")
+                lines.append(f"  Oldest:   {type_stats['oldest_uploaded']}")
+            lines.append("")
 
-        logger.info("=" * 60)
+        lines.append("=" * 60)
+        logger.info("\n".join(lines))
 
         return stats
 
@@ -76,8 +85,8 @@ class CleanupService:
             dry_run: If True, only show what would be deleted
         """
         logger.info("=" * 60)
-        logger.info(f"Starting Cleanup Operation")
-        logger.info(f"Timestamp: {datetime.now().isoformat()}")
+        logger.info("Starting Cleanup Operation")
+        logger.info("Timestamp: %s", datetime.now().isoformat())
         if dry_run:
             logger.info("DRY RUN MODE - No data will be deleted")
         logger.info("=" * 60)
@@ -85,26 +94,28 @@ class CleanupService:
         # Get stats before cleanup
         logger.info("\nBefore Cleanup:")
         stats_before = self.db.get_cleanup_stats()
-        logger.info(f"  Total uploaded records: {stats_before['total_uploaded']}")
+        logger.info("  Total uploaded records: %s", stats_before['total_uploaded'])
 
         # Run cleanup
         results = self.db.cleanup_all_uploaded_data(
             days_old=self.days_old,
-            dry_run=dry_run
+            dry_run=dry_run,
+            batch_size=self.batch_size,
+            stop_event=self._stop_event
         )
 
         # Get stats after cleanup
         if not dry_run:
             logger.info("\nAfter Cleanup:")
-            stats_after = self.db.get_cleanup_stats()
-            logger.info(f"  Total uploaded records: {stats_after['total_uploaded']}")
-            logger.info(f"  Records deleted: {results['total_records_deleted']}")
+            stats_after = self._stats_after_cleanup(stats_before, results)
+            logger.info("  Total uploaded records: %s", stats_after['total_uploaded'])
+            logger.info("  Records deleted: %s", results['total_records_deleted'])
 
         logger.info("\nCleanup Summary:")
         for data_type, result in results['data_types'].items():
             deleted = result.get('records_deleted', 0)
             if deleted > 0:
-                logger.info(f"  {data_type}: {deleted} records deleted")
+                logger.info("  %s: %s records deleted", data_type, deleted)
 
         logger.info("=" * 60)
         logger.info("Cleanup Complete")
@@ -112,6 +123,34 @@ class CleanupService:
 
         return results
 
+    @staticmethod
+    def _stats_after_cleanup(stats_before: Dict[str, Any], results: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Derive post-cleanup statistics from the pre-cleanup snapshot
+
+        Avoids rescanning every data table just to report the new totals.
+        oldest_uploaded is cleared for data types that had rows deleted,
+        since it can't be known without a query.
+
+        Args:
+            stats_before: Result of get_cleanup_stats() taken before cleanup
+            results: Result of cleanup_all_uploaded_data()
+
+        Returns:
+            Statistics dictionary in the get_cleanup_stats() format
+        """
+        stats_after = copy.deepcopy(stats_before)
+        stats_after['total_uploaded'] -= results['total_records_deleted']
+
+        for data_type, result in results['data_types'].items():
+            deleted = result.get('records_deleted', 0)
+            type_stats = stats_after['by_data_type'].get(data_type)
+            if deleted > 0 and type_stats:
+                type_stats['uploaded'] -= deleted
+                type_stats['oldest_uploaded'] = None
+
+        return stats_after
+
     def run(self, interval: int = 3600, dry_run: bool = False):
         """
         Main service loop
@@ -134,8 +173,9 @@ class CleanupService:
 
         # Continuous mode
         self.running = True
-        logger.info(f"Running in continuous mode")
-        logger.info(f"Cleanup interval: {interval} seconds ({interval/3600:.1f} hours)")
+        self._stop_event.clear()
+        logger.info("Running in continuous mode")
+        logger.info("Cleanup interval: %s seconds (%.1f hours)", interval, interval / 3600)
         logger.info("Press Ctrl+C to stop")
 
         try:
@@ -144,12 +184,13 @@ class CleanupService:
                     self.run_cleanup(dry_run=dry_run)
 
                 except Exception as e:
-                    logger.error(f"Error during cleanup: {e}", exc_info=True)
+                    logger.error("Error during cleanup: %s", e, exc_info=True)
 
-                # Sleep until next cleanup
+                # Wait until next cleanup (returns early on stop())
                 if self.running:
-                    logger.info(f"Next cleanup in {interval} seconds...")
-                    time.sleep(interval)
+                    logger.info("Next cleanup in %s seconds...", interval)
+                    if self._stop_event.wait(interval):
+                        break
 
         except KeyboardInterrupt:
             logger.info("Received shutdown signal (Ctrl+C)")
@@ -158,10 +199,21 @@ class CleanupService:
 
         return 0
 
+    def request_stop(self, signum=None, frame=None):
+        """
+        Ask the service loop to exit
+
+        Only flips flags, so it is safe to use directly as a signal handler;
+        run() does the actual shutdown work once its wait returns.
+        """
+        self.running = False
+        self._stop_event.set()
+
     def stop(self):
         """Stop the service"""
         logger.info("Cleanup Service stopping...")
         self.running = False
+        self._stop_event.set()
         logger.info("Cleanup Service stopped")
 
 
@@ -214,6 +266,12 @@ Examples:
         default=3600,
         help='Cleanup interval in seconds (default: 3600 = 1 hour)'
     )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=CLEANUP_BATCH_SIZE,
+        help=f'Rows deleted per transaction, 0 for no limit (default: {CLEANUP_BATCH_SIZE})'
+    )
     parser.add_argument(
         '--dry-run',
         action='store_true',
@@ -249,7 +307,8 @@ Examples:
         service = CleanupService(
             db_path=args.db,
             days_old=args.days,
-            run_once=args.once
+            run_once=args.once,
+            batch_size=args.batch_size
         )
 
         # Show stats only
@@ -258,6 +317,11 @@ Examples:
             service.print_stats()
             return 0
 
+        # In continuous mode, SIGTERM (systemd stop) ends the loop after the
+        # current batch; one-shot runs keep the default and exit immediately
+        if not args.once:
+            signal.signal(signal.SIGTERM, service.request_stop)
+
         # Run cleanup
         return service.run(
             interval=args.interval,
@@ -265,7 +329,7 @@ Examples:
         )
 
     except Exception as e:
-        logger.error(f"Failed to start cleanup service: {e}", exc_info=True)
+        logger.error("Failed to start cleanup service: %s", e, exc_info=True)
         return 1
 
 
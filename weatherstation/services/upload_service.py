@@ -3,17 +3,39 @@ Upload Service
 Handles batch upload of data to main server with retry mechanism
 """
 
+import gzip
+import json
 import time
+import zlib
+import random
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from typing import List, Dict, Any
-from datetime import datetime
-import yaml
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Any, Iterator
 
 from weatherstation.database.db_manager import DatabaseManager
 from weatherstation.utils.logger import get_logger, setup_logging
+from weatherstation.utils.yaml_cache import load_yaml_cached
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the stdlib encoder
+    orjson = None
 
 logger = get_logger(__name__)
 
+# Upper bound for the randomized wait after repeated upload failures (seconds)
+MAX_RETRY_BACKOFF = 600
+
+
+def _dumps(obj) -> bytes:
+    """Encode obj as compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
 
 class UploadService:
     """
@@ -30,8 +52,7 @@ class UploadService:
         """
         # Load configuration
         if config_path:
-            with open(config_path, 'r') as f:
-                self.config = yaml.safe_load(f)
+            self.config = load_yaml_cached(config_path) or {}
         elif config:
             self.config = config
         else:
@@ -44,9 +65,9 @@ class UploadService:
             log_file=log_config.get('log_file')
         )
 
-        # Initialize database
-        db_path = self.config.get('database', {}).get('path', './data/weatherstation.db')
-        self.db = DatabaseManager(db_path)
+        # Database is opened on first use (see the db property)
+        self._db_path = self.config.get('database', {}).get('path', './data/weatherstation.db')
+        self._db = None
 
         # Upload configuration
         upload_config = self.config.get('upload', {})
@@ -57,21 +78,55 @@ class UploadService:
         self.server_url = upload_config.get('main_server_url')
         self.api_key = upload_config.get('api_key')
         self.timeout = upload_config.get('timeout', 30)
+        self.gzip = upload_config.get('gzip', False)
+        self.stream_body = upload_config.get('stream_body', False)
+        self.hoist_constants = upload_config.get('hoist_constants', False)
 
         # Cleanup configuration
         db_config = self.config.get('database', {})
         self.auto_cleanup_enabled = db_config.get('auto_cleanup_enabled', True)
         self.auto_cleanup_days = db_config.get('auto_cleanup_days', 7)
+        # Small batches with a pause keep each write-lock hold short so
+        # sensor inserts aren't stalled behind a large cleanup
+        self.auto_cleanup_batch_size = db_config.get('auto_cleanup_batch_size', 500)
+        self.auto_cleanup_batch_pause = db_config.get('auto_cleanup_batch_pause', 0.05)
+
+        # Keep-alive connection pool reused across upload cycles
+        self._session = self._create_session()
+        self._request_template = None  # Prepared POST, built on first upload
+
+        # Circuit breaker: after max_retry consecutive failures, uploads are
+        # skipped until a randomized backoff (full jitter) has passed
+        self._failures = 0
+        self._circuit_open_until = 0.0
+
+        # Set when the last PZEM upload sent a full batch_size of records
+        # (more is almost certainly pending, so the next cycle skips counting)
+        self._last_full_batch = False
+
+        # Cleanup runs on its own worker so a slow server (or a long delete)
+        # never holds up the other; at most one cleanup is queued at a time
+        self._cleanup_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cleanup')
+        self._cleanup_future = None
+        self._cleanup_stop = threading.Event()  # Interrupts cleanup between batches
 
         self.running = False
+        self._stop_event = threading.Event()  # Wakes the loop's wait on stop()
 
         logger.info("Upload Service initialized")
-        logger.info(f"Upload interval: {self.interval}s")
-        logger.info(f"Batch size: {self.batch_size}")
-        logger.info(f"Server URL: {self.server_url}")
-        logger.info(f"Auto-cleanup: {'enabled' if self.auto_cleanup_enabled else 'disabled'}")
+        logger.info("Upload interval: %ss", self.interval)
+        logger.info("Batch size: %s", self.batch_size)
+        logger.info("Server URL: %s", self.server_url)
+        logger.info("Auto-cleanup: %s", 'enabled' if self.auto_cleanup_enabled else 'disabled')
         if self.auto_cleanup_enabled:
-            logger.info(f"Cleanup threshold: {self.auto_cleanup_days} days")
+            logger.info("Cleanup threshold: %s days", self.auto_cleanup_days)
+
+    @property
+    def db(self) -> DatabaseManager:
+        """Database manager, opened on first access"""
+        if self._db is None:
+            self._db = DatabaseManager(self._db_path)
+        return self._db
 
     def _default_config(self) -> Dict[str, Any]:
         """Get default configuration"""
@@ -86,7 +141,9 @@ class UploadService:
                 'retry_interval': 30,
                 'main_server_url': 'http://example.com/api/data',
                 'api_key': 'your_api_key',
-                'timeout': 30
+                'timeout': 30,
+                'gzip': False,
+                'stream_body': False
             },
             'logging': {
                 'level': 'INFO',
@@ -94,48 +151,211 @@ class UploadService:
             }
         }
 
+    def _create_session(self) -> requests.Session:
+        """Create the HTTP session used for all uploads"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {self.api_key}'
+        })
+        return session
+
+    def _post(self, body, headers: Dict[str, str]) -> requests.Response:
+        """
+        POST a body to the main server
+
+        The URL, method, session headers and environment settings (proxies,
+        CA bundle) are resolved once into a PreparedRequest template; each
+        call only copies it and attaches the body.
+
+        Args:
+            body: Request body (bytes or iterator of chunks)
+            headers: Extra headers for this request
+
+        Returns:
+            Server response with the body not yet read (stream=True); the
+            caller reads it or releases it with _discard_body()
+        """
+        if self._request_template is None:
+            template = self._session.prepare_request(
+                requests.Request('POST', self.server_url)
+            )
+            # stream=True: the body is only read when the caller wants it
+            settings = self._session.merge_environment_settings(
+                template.url, {}, True, None, None
+            )
+            self._request_template = (template, settings)
+
+        template, settings = self._request_template
+        request = template.copy()
+        request.headers.update(headers)
+        # The template carries Content-Length: 0 from its empty body; drop it
+        # so a streamed body is sent chunked
+        request.headers.pop('Content-Length', None)
+        request.prepare_body(body, None)
+        return self._session.send(request, timeout=self.timeout, **settings)
+
+    @staticmethod
+    def _discard_body(response: requests.Response):
+        """Read and drop the remaining body so the connection goes back to the pool"""
+        response.raw.drain_conn()
+        response.close()
+
+    def _encode_payload(self, payload: Dict[str, Any]):
+        """
+        Serialize an upload payload to a request body
+
+        With upload.stream_body the body is a generator that encodes one
+        record at a time (sent chunked), so the whole serialized batch is
+        never held in memory.
+
+        Args:
+            payload: Payload dictionary with a 'records' list
+
+        Returns:
+            Tuple of (body bytes or iterator of chunks, extra request headers)
+        """
+        headers = {'Content-Encoding': 'gzip'} if self.gzip else {}
+
+        if self.stream_body:
+            chunks = self._iter_payload_chunks(payload)
+            if self.gzip:
+                chunks = self._gzip_chunks(chunks)
+            return chunks, headers
+
+        body = _dumps(payload)
+        if self.gzip:
+            body = gzip.compress(body, compresslevel=6)
+        return body, headers
+
+    @staticmethod
+    def _hoist_constants(records: List[Dict[str, Any]]):
+        """
+        Split out fields that have the same value in every record
+
+        Args:
+            records: Records to upload (not modified)
+
+        Returns:
+            Tuple of (constant fields, records without those fields)
+        """
+        if len(records) < 2:
+            return {}, records
+
+        first = records[0]
+        constants = {
+            key: value for key, value in first.items()
+            if all(key in record and record[key] == value for record in records[1:])
+        }
+        if not constants:
+            return {}, records
+
+        stripped = [
+            {key: value for key, value in record.items() if key not in constants}
+            for record in records
+        ]
+        return constants, stripped
+
+    @staticmethod
+    def _iter_payload_chunks(payload: Dict[str, Any]) -> Iterator[bytes]:
+        """Yield the JSON encoding of payload, one record per chunk"""
+        head = {key: value for key, value in payload.items() if key != 'records'}
+        yield _dumps(head)[:-1] + b',"records":['
+        for i, record in enumerate(payload['records']):
+            yield b',' + _dumps(record) if i else _dumps(record)
+        yield b']}'
+
+    @staticmethod
+    def _gzip_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+        """Gzip-compress a stream of chunks"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def _record_failure(self):
+        """Count a failed upload and open the circuit after max_retry in a row"""
+        self._failures += 1
+        if self._failures >= self.max_retry:
+            delay = random.uniform(
+                0, min(self.retry_interval * 2 ** self._failures, MAX_RETRY_BACKOFF)
+            )
+            self._circuit_open_until = time.monotonic() + delay
+            logger.warning(
+                "%d consecutive upload failures, pausing uploads for %.0fs",
+                self._failures, delay
+            )
+
     def upload_pzem_data(self) -> bool:
         """Upload pending PZEM data"""
+        if time.monotonic() < self._circuit_open_until:
+            logger.debug("Upload circuit open, skipping PZEM upload")
+            return False
+
+        record_ids = []
+        confirmed = False
+        self._last_full_batch = False
+
         try:
-            # Get pending data
-            pending = self.db.get_pending_pzem_data(limit=self.batch_size)
+            # Claim pending data (fetch + mark in flight in one transaction)
+            pending = self.db.claim_pending_pzem_data(limit=self.batch_size)
 
             if not pending:
                 logger.debug("No pending PZEM data to upload")
                 return True
 
-            logger.info(f"Uploading {len(pending)} PZEM records...")
+            logger.info("Uploading %d PZEM records...", len(pending))
+
+            # Collect record ids and distinct devices in one pass
+            device_ids = set()
+            for record in pending:
+                record_ids.append(record['id'])
+                device_ids.add(record['device_id'])
 
             # Build payload
-            batch_id = f"pzem_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
+            t = time.gmtime()
+            batch_id = (
+                f"pzem_{t.tm_year:04d}{t.tm_mon:02d}{t.tm_mday:02d}"
+                f"_{t.tm_hour:02d}{t.tm_min:02d}{t.tm_sec:02d}"
+            )
             payload = {
                 'source': 'raspberry_pi_weather_station',
                 'data_type': 'pzem',
-                'timestamp': datetime.utcnow().isoformat() + 'Z',
+                'timestamp': (
+                    f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}"
+                    f"T{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}Z"
+                ),
                 'batch_id': batch_id,
-                'device_count': len(set(r['device_id'] for r in pending)),
+                'device_count': len(device_ids),
                 'records': pending
             }
 
-            # Send to server
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {self.api_key}'
-            }
+            # Fields shared by every record are sent once; the server
+            # rebuilds each record as constants merged with the record
+            if self.hoist_constants:
+                constants, payload['records'] = self._hoist_constants(pending)
+                if constants:
+                    payload['constants'] = constants
 
-            response = requests.post(
-                self.server_url,
-                json=payload,
-                headers=headers,
-                timeout=self.timeout
-            )
+            # Send to server (auth headers are set on the session)
+            body, headers = self._encode_payload(payload)
+            response = self._post(body, headers)
 
             # Check response
             if response.status_code == 200:
-                logger.info(f"Upload successful: {len(pending)} records")
+                # Acks are not used; skip buffering and decoding them
+                self._discard_body(response)
+                logger.info("Upload successful: %d records", len(pending))
+                self._failures = 0
+                confirmed = True
+                self._last_full_batch = len(pending) >= self.batch_size
 
                 # Mark as uploaded
-                record_ids = [r['id'] for r in pending]
                 self.db.mark_pzem_uploaded(record_ids)
 
                 # Log success
@@ -149,8 +369,9 @@ class UploadService:
 
                 return True
             else:
+                error_text = response.content[:500].decode('utf-8', 'replace')
                 logger.error(
-                    f"Upload failed: HTTP {response.status_code} - {response.text}"
+                    "Upload failed: HTTP %d - %s", response.status_code, error_text
                 )
 
                 # Log failure
@@ -160,64 +381,97 @@ class UploadService:
                     record_count=len(pending),
                     status='failed',
                     http_status_code=response.status_code,
-                    error_message=response.text[:500]
+                    error_message=error_text
                 )
 
+                self._record_failure()
                 return False
 
         except requests.exceptions.Timeout:
-            logger.error(f"Upload timeout after {self.timeout}s")
+            logger.error("Upload timeout after %ss", self.timeout)
+            self._record_failure()
             return False
         except requests.exceptions.ConnectionError:
             logger.error("Connection error - server unreachable")
+            self._record_failure()
             return False
         except Exception as e:
-            logger.error(f"Upload error: {e}", exc_info=True)
+            logger.error("Upload error: %s", e, exc_info=True)
             return False
+        finally:
+            # Anything the server didn't accept goes back to pending
+            if record_ids and not confirmed:
+                self.db.unclaim_pzem_data(record_ids)
 
     def run_auto_cleanup(self):
-        """Run automatic cleanup of old uploaded data"""
+        """Schedule automatic cleanup of old uploaded data on the cleanup worker"""
         if not self.auto_cleanup_enabled:
             return
 
+        if self._cleanup_future is not None and not self._cleanup_future.done():
+            logger.debug("Auto-cleanup still running, not scheduling another")
+            return
+
+        self._cleanup_future = self._cleanup_pool.submit(self._auto_cleanup)
+
+    def wait_for_cleanup(self):
+        """Block until a scheduled auto-cleanup has finished"""
+        if self._cleanup_future is not None:
+            self._cleanup_future.result()
+
+    def _auto_cleanup(self):
+        """Delete old uploaded data (runs on the cleanup worker thread)"""
         try:
-            logger.info(f"Running auto-cleanup (data older than {self.auto_cleanup_days} days)...")
+            logger.info("Running auto-cleanup (data older than %s days)...", self.auto_cleanup_days)
 
             results = self.db.cleanup_all_uploaded_data(
                 days_old=self.auto_cleanup_days,
-                dry_run=False
+                dry_run=False,
+                batch_size=self.auto_cleanup_batch_size,
+                batch_pause=self.auto_cleanup_batch_pause,
+                stop_event=self._cleanup_stop
             )
 
             total_deleted = results.get('total_records_deleted', 0)
 
             if total_deleted > 0:
-                logger.info(f"Auto-cleanup: deleted {total_deleted} records")
+                logger.info("Auto-cleanup: deleted %d records", total_deleted)
             else:
                 logger.debug("Auto-cleanup: no old records to delete")
 
         except Exception as e:
-            logger.error(f"Auto-cleanup error: {e}", exc_info=True)
+            logger.error("Auto-cleanup error: %s", e, exc_info=True)
 
     def upload_all_pending(self):
         """Upload all pending data (PZEM, weather, battery)"""
         logger.info("Starting upload cycle...")
 
-        # Check pending counts
-        pzem_pending = self.db.get_pending_upload_count('pzem')
-        weather_pending = self.db.get_pending_upload_count('weather')
-        battery_pending = self.db.get_pending_upload_count('battery')
+        # Records claimed by an upload that never finished (crash/kill) go
+        # back to pending. A live upload gives up within a connect plus a
+        # read timeout, so younger claims may belong to another uploader.
+        released = self.db.release_pzem_claims(max_age=2 * self.timeout)
+        if released:
+            logger.warning("Returned %d stale in-flight PZEM records to pending", released)
+
+        # Check pending counts (not needed right after a full batch)
+        if self._last_full_batch:
+            logger.info("Previous PZEM batch was full, uploading without counting")
+            pzem_pending = self.batch_size
+        else:
+            counts = self.db.get_pending_counts()
+            pzem_pending = counts['pzem']
 
-        logger.info(
-            f"Pending: PZEM={pzem_pending}, "
-            f"Weather={weather_pending}, Battery={battery_pending}"
-        )
+            logger.info(
+                "Pending: PZEM=%d, Weather=%d, Battery=%d",
+                pzem_pending, counts['weather'], counts['battery']
+            )
 
-        if pzem_pending == 0 and weather_pending == 0 and battery_pending == 0:
-            logger.info("No pending data to upload")
+            if not any(counts.values()):
+                logger.info("No pending data to upload")
 
-            # Still run cleanup even if no pending uploads
-            self.run_auto_cleanup()
-            return
+                # Still run cleanup even if no pending uploads
+                self.run_auto_cleanup()
+                return
 
         # Upload PZEM data
         upload_success = False
@@ -245,27 +499,55 @@ class UploadService:
         logger.info("=" * 60)
 
         self.running = True
+        self._stop_event.clear()
+
+        # Cycles start on a fixed cadence measured from the first one, so
+        # upload time doesn't push the schedule back
+        next_run = time.monotonic()
 
         try:
             while self.running:
                 try:
                     self.upload_all_pending()
                 except Exception as e:
-                    logger.error(f"Error in upload cycle: {e}", exc_info=True)
-
-                # Sleep until next upload
-                logger.debug(f"Sleeping for {self.interval}s...")
-                time.sleep(self.interval)
+                    logger.error("Error in upload cycle: %s", e, exc_info=True)
+
+                # Wait until next upload (returns early on stop())
+                next_run += self.interval
+                delay = next_run - time.monotonic()
+                if delay < 0:
+                    # Cycle overran the interval; skip the missed slots
+                    next_run = time.monotonic()
+                    delay = 0
+                logger.debug("Sleeping for %.1fs...", delay)
+                if self._stop_event.wait(delay):
+                    break
 
         except KeyboardInterrupt:
             logger.info("Received shutdown signal (Ctrl+C)")
         finally:
             self.stop()
 
+    def request_stop(self, signum=None, frame=None):
+        """
+        Ask the service loop to exit
+
+        Only flips flags, so it is safe to use directly as a signal handler;
+        run() does the actual shutdown work once its wait returns.
+        """
+        self.running = False
+        self._stop_event.set()
+
     def stop(self):
         """Stop the service"""
         logger.info("Upload Service stopping...")
         self.running = False
+        self._stop_event.set()
+        self._session.close()
+        # A running cleanup stops after its current batch (already committed
+        # batches stay deleted); a queued one is dropped
+        self._cleanup_stop.set()
+        self._cleanup_pool.shutdown(wait=True, cancel_futures=True)
         logger.info("Upload Service stopped")
 
 
@@ -290,15 +572,21 @@ def main():
     try:
         service = UploadService(config_path=args.config)
 
+        # systemd stops the service with SIGTERM
+        signal.signal(signal.SIGTERM, service.request_stop)
+
         if args.test:
             logger.info("Running in TEST mode (single upload)")
             service.upload_all_pending()
+            # Single run: let the scheduled cleanup finish, stop() would cut it short
+            service.wait_for_cleanup()
+            service.stop()
             logger.info("Test complete")
         else:
             service.run()
 
     except Exception as e:
-        logger.error(f"Failed to start service: {e}", exc_info=True)
+        logger.error("Failed to start service: %s", e, exc_info=True)
         return 1
 
     return 0
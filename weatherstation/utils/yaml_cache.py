@@ -0,0 +1,63 @@
+"""
+YAML Config Cache
+Parses YAML files once and reuses the result until the file changes on disk
+"""
+
+import os
+import copy
+import threading
+from collections import OrderedDict
+from typing import Any
+
+import yaml
+
+from weatherstation.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Prefer libyaml's C loader; fall back to the pure-Python one if PyYAML
+# was built without libyaml
+_YLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+if _YLoader is yaml.SafeLoader:
+    logger.warning(
+        "PyYAML built without libyaml, using the slower pure-Python loader "
+        "(install python3-yaml or libyaml-dev and reinstall PyYAML)"
+    )
+
+# Maximum number of parsed files kept in memory
+MAX_ENTRIES = 100
+
+# abspath -> (mtime_ns, size, parsed data), least recently used first
+_CACHE: 'OrderedDict[str, tuple]' = OrderedDict()
+_lock = threading.Lock()
+
+
+def load_yaml_cached(path: str) -> Any:
+    """
+    Load a YAML file, re-parsing only when its mtime or size has changed
+
+    Args:
+        path: Path to YAML file
+
+    Returns:
+        Deep copy of the parsed document (callers may modify it freely)
+    """
+    key = os.path.abspath(path)
+    st = os.stat(key)
+
+    with _lock:
+        entry = _CACHE.get(key)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            _CACHE.move_to_end(key)
+            return copy.deepcopy(entry[2])
+
+    with open(key, 'r') as f:
+        data = yaml.load(f, Loader=_YLoader)
+
+    with _lock:
+        _CACHE[key] = (st.st_mtime_ns, st.st_size, data)
+        _CACHE.move_to_end(key)
+        while len(_CACHE) > MAX_ENTRIES:
+            _CACHE.popitem(last=False)
+
+    return copy.deepcopy(data)